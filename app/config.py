@@ -1,5 +1,8 @@
+import logging
+import sys
+from functools import lru_cache
 from pydantic_settings import BaseSettings
-from pydantic import ConfigDict
+from pydantic import ConfigDict, field_validator
 
 
 class Settings(BaseSettings):
@@ -11,10 +14,19 @@ class Settings(BaseSettings):
     rustfs_secret_key: str = "rustfssecret"
     rustfs_bucket_name: str = "pdf-processing"
     rustfs_region: str = "us-east-1"  # RustFS doesn't validate region
+    rustfs_skip_bucket_check: bool = True  # 启动时不检查存储桶 (部署时运行 python -m app.services.storage --ensure-bucket)
+    rustfs_max_pool_connections: int = 64  # boto3 连接池大小 (每个进程共享一个客户端)
+    rustfs_multipart_threshold_mb: int = 16  # 超过该大小才使用分片上传 (MB)
+    rustfs_multipart_chunksize_mb: int = 16  # 分片大小 (MB, 1GB 以上的文件自动使用更大分片)
+    rustfs_max_concurrency: int = 16  # 分片并发传输线程数
     
     # Application Configuration
     app_host: str = "0.0.0.0"
     app_port: int = 8000
+    cors_origins: tuple[str, ...] = ("*",)  # 允许的跨域来源, 生产环境请填写具体域名 (JSON 数组)
+    
+    # Logging Configuration
+    log_level: str = "INFO"  # 日志级别 (DEBUG/INFO/WARNING/ERROR)
     
     # Cache Configuration
     cache_dir: str = "cache"  # 本地缓存目录
@@ -28,7 +40,7 @@ class Settings(BaseSettings):
     
     # Dify Workflow 输出变量配置
     # 在这里维护您的 Dify workflow 输出的所有变量名
-    dify_output_variables: list[str] = [
+    dify_output_variables: tuple[str, ...] = (
         "confirmation_record",    # 确认记录 (主要输出)
         "extracted_data",       # 提取的数据
         "baseline_data",        # 基线数据
@@ -38,12 +50,36 @@ class Settings(BaseSettings):
         # "validation_result",    # 验证结果
         # "confidence_score",     # 置信度分数
         # "processing_status",    # 处理状态
-    ]
+    )
+
+    @field_validator("dify_output_variables")
+    @classmethod
+    def _intern_variable_names(cls, value: tuple[str, ...]) -> tuple[str, ...]:
+        """驻留从环境变量读取的变量名，按名称查找时可走字符串指针比较的快速路径"""
+        return tuple(sys.intern(name) for name in value)
 
     model_config = ConfigDict(env_file=".env", case_sensitive=False)
-    # Logging Configuration
-    log_level: str = model_config.get("LOG_LEVEL", "INFO")
-    
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """返回进程内唯一的 Settings 实例 (测试中可用 get_settings.cache_clear() 重置)"""
+    return Settings()
+
+
+def __getattr__(name: str) -> Settings:
+    """延迟创建 settings：仅在首次访问 app.config.settings 时解析环境变量和 .env"""
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def configure_logging() -> None:
+    """按 settings.log_level 配置根日志；根日志已有 handler 时不做任何事 (可重复调用)"""
+    if logging.getLogger().handlers:
+        return
+    logging.basicConfig(
+        level=getattr(logging, get_settings().log_level.upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
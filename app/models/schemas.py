@@ -1,9 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, Any, Dict
 
 
 class FileProcessingResponse(BaseModel):
     """Response model for file processing"""
+    model_config = ConfigDict(defer_build=True)
+
     file_processing_id: str
     pdf_path: str
     image_path: str
@@ -13,6 +15,8 @@ class FileProcessingResponse(BaseModel):
 
 class DifyProcessResponse(BaseModel):
     """Response model for Dify document processing"""
+    model_config = ConfigDict(defer_build=True, extra="ignore")
+
     success: bool
     answer: Optional[str] = None
     confirmation_record: Optional[Any] = None
@@ -1,18 +1,22 @@
 """Dify completion workflow endpoints"""
 from fastapi import APIRouter, HTTPException, File, UploadFile, Form
+from fastapi.responses import ORJSONResponse
 from app.models.schemas import DifyProcessResponse
 from app.services.dify_service import dify_service
-from app.services.storage import storage_service
+from app.services.storage import StorageUnavailableError, storage_service
 from app.services.pdf_processor import pdf_service
+import asyncio
 import logging
-import uuid
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/dify", tags=["dify"])
+router = APIRouter(prefix="/dify", tags=["dify"], default_response_class=ORJSONResponse)
 
 
-@router.post("/process-document", response_model=DifyProcessResponse)
+@router.post(
+    "/process-document",
+    responses={200: {"model": DifyProcessResponse}}
+)
 async def process_document(
     file: UploadFile = File(..., description="PDF file to process"),
     user_id: str = Form(default="default-user", description="User identifier")
@@ -27,56 +31,65 @@ async def process_document(
     """
     try:
         # 1. 验证文件类型
-        if not file.content_type or "pdf" not in file.content_type.lower():
+        if not pdf_service.is_pdf_content_type(file.content_type):
             raise HTTPException(
                 status_code=400,
                 detail="Only PDF files are allowed"
             )
         
-        logger.info(f"Processing PDF file: {file.filename}")
+        logger.info("Processing PDF file: %s", file.filename)
         
-        # 2. 读取 PDF 文件
-        pdf_data = await file.read()
-        
-        # 3. 验证 PDF
-        if not pdf_service.validate_pdf(pdf_data):
+        # 2. 先校验文件头，避免把非 PDF 文件整体读入内存
+        if not pdf_service.validate_pdf_header(await file.read(1024)):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid PDF file"
             )
+        await file.seek(0)
         
-        # 4. 生成唯一 ID
-        file_processing_id = str(uuid.uuid4())
-        
-        # 5. 提取首页为图片
-        logger.info(f"Extracting first page as image for: {file_processing_id}")
-        try:
-            image_data = pdf_service.extract_first_page_as_image(pdf_data)
-        except Exception as e:
-            logger.error(f"Failed to extract first page: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to extract first page: {str(e)}"
-            )
+        # 读取 PDF 文件
+        pdf_data = await file.read()
         
-        # 6. 上传图片到对象存储
-        image_path = f"{file_processing_id}/first_page.png"
-        image_uploaded = storage_service.upload_file(
-            file_data=image_data,
-            object_name=image_path,
-            content_type="image/png"
-        )
+        # 3. 按内容生成 ID，相同的 PDF 复用已上传的首页图片
+        file_processing_id = await asyncio.to_thread(pdf_service.content_digest, pdf_data)
+        # 图片仅供 Dify 视觉模型读取，使用 JPEG 比 PNG 编码更快、体积更小
+        image_path = f"{file_processing_id}/first_page.jpg"
         
-        if not image_uploaded:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to upload image to storage"
+        if await asyncio.to_thread(storage_service.file_exists, image_path):
+            logger.info("Reusing existing first page image for: %s", file_processing_id)
+        else:
+            # 4. 验证 PDF 并提取首页为图片 (只解析一次；CPU 密集，放到线程中避免阻塞事件循环)
+            logger.info("Extracting first page as image for: %s", file_processing_id)
+            try:
+                is_valid, image_data = await asyncio.to_thread(
+                    pdf_service.validate_and_render_first_page, pdf_data, image_format="jpeg"
+                )
+            except Exception as e:
+                logger.error("Failed to extract first page: %s", e)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to extract first page: {str(e)}"
+                )
+            
+            if not is_valid:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invalid PDF file"
+                )
+            
+            # 5. 上传图片到对象存储 (失败时抛出 StorageUnavailableError)
+            await asyncio.to_thread(
+                storage_service.upload_file,
+                file_data=image_data,
+                object_name=image_path,
+                content_type="image/jpeg"
             )
         
-        # 7. 生成预览图片的公开 URL（使用 presigned URL）
-        preview_url = storage_service.generate_presigned_url(
+        # 生成预览图片的 presigned URL（1小时有效期；已签名的 URL 会被复用，通常只是一次字典查找）
+        preview_url = await asyncio.to_thread(
+            storage_service.generate_presigned_url,
             object_name=image_path,
-            expiration=3600  # 1小时有效期
+            expiration=3600
         )
         
         if not preview_url:
@@ -85,10 +98,10 @@ async def process_document(
                 detail="Failed to generate preview URL"
             )
         
-        logger.info(f"Generated preview URL: {preview_url}")
+        logger.info("Generated preview URL: %s", preview_url)
         
-        # 8. 调用 Dify 处理
-        logger.info(f"Sending to Dify for analysis")
+        # 6. 调用 Dify 处理
+        logger.info("Sending to Dify for analysis")
         result = await dify_service.process_document(
             preview_url=preview_url,
             user_id=user_id
@@ -100,14 +113,15 @@ async def process_document(
                 detail=f"Dify processing failed: {result.get('error', 'Unknown error')}"
             )
         
-        logger.info(f"Dify processing completed for: {file_processing_id}")
+        logger.info("Dify processing completed for: %s", file_processing_id)
         
-        return DifyProcessResponse(**result)
+        # result 由 dify_service 生成且已符合 DifyProcessResponse 结构，直接序列化返回
+        return ORJSONResponse(result)
         
-    except HTTPException:
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
-        logger.error(f"Error in process_document endpoint: {str(e)}", exc_info=True)
+        logger.error("Error in process_document endpoint: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         await file.close()
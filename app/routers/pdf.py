@@ -1,8 +1,9 @@
-import uuid
+import asyncio
+from urllib.parse import quote
 from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from app.models.schemas import FileProcessingResponse
-from app.services.storage import storage_service
+from app.services.storage import StorageUnavailableError, storage_service
 from app.services.pdf_processor import pdf_service
 from app.services.cache import cache_service
 import logging
@@ -11,98 +12,126 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/pdf", tags=["PDF Processing"])
 
+# 重定向下载时预签名 URL 的有效期 (秒)
+_REDIRECT_URL_EXPIRATION = 600
+
 
 @router.post("/upload", response_model=FileProcessingResponse)
 async def upload_pdf(file: UploadFile = File(...)):
     """
     Upload a PDF file, extract the first page as an image, and save both to object storage.
     
+    The processing ID is a digest of the PDF content: the same bytes always map to the
+    same ID, and re-uploads reuse the stored objects instead of processing them again.
+    
     Args:
         file: PDF file to upload
         
     Returns:
         FileProcessingResponse with file processing ID and paths
     """
-    logger.debug(f"Received PDF upload request: filename={file.filename}, content_type={file.content_type}")
+    logger.debug("Received PDF upload request: filename=%s, content_type=%s", file.filename, file.content_type)
     
     # Validate file type
-    if not file.content_type or "pdf" not in file.content_type.lower():
-        logger.warning(f"Invalid file type: {file.content_type}")
+    if not pdf_service.is_pdf_content_type(file.content_type):
+        logger.warning("Invalid file type: %s", file.content_type)
         raise HTTPException(
             status_code=400, 
             detail="Only PDF files are allowed"
         )
     
     try:
-        # Read PDF file
-        pdf_data = await file.read()
-        logger.debug(f"Read PDF file, size: {len(pdf_data)} bytes")
-        
-        # Validate PDF
-        if not pdf_service.validate_pdf(pdf_data):
-            logger.error("PDF validation failed")
+        # Check the PDF signature before reading the whole upload into memory
+        if not pdf_service.validate_pdf_header(await file.read(1024)):
+            logger.error("PDF header validation failed")
             raise HTTPException(
                 status_code=400,
                 detail="Invalid PDF file"
             )
+        await file.seek(0)
+        
+        # Read PDF file
+        pdf_data = await file.read()
+        logger.debug("Read PDF file, size: %d bytes", len(pdf_data))
         
-        # Generate unique file processing ID
-        file_processing_id = str(uuid.uuid4())
-        logger.debug(f"Generated file processing ID: {file_processing_id}")
+        # Content-addressed processing ID: identical uploads map to the same objects
+        file_processing_id = await asyncio.to_thread(pdf_service.content_digest, pdf_data)
+        logger.debug("Generated file processing ID: %s", file_processing_id)
         
         # Define paths in object storage (使用固定名称以便下载)
         pdf_path = f"{file_processing_id}/original.pdf"
         image_path = f"{file_processing_id}/first_page.png"
-        logger.debug(f"Storage paths - PDF: {pdf_path}, Image: {image_path}")
-        
-        # Upload PDF to object storage
-        logger.debug("Uploading PDF to storage...")
-        pdf_uploaded = storage_service.upload_file(
-            file_data=pdf_data,
-            object_name=pdf_path,
-            content_type="application/pdf"
+        logger.debug("Storage paths - PDF: %s, Image: %s", pdf_path, image_path)
+        
+        # Skip rendering and uploading if this PDF has already been processed
+        pdf_exists, image_exists = await asyncio.gather(
+            asyncio.to_thread(storage_service.file_exists, pdf_path),
+            asyncio.to_thread(storage_service.file_exists, image_path)
         )
         
-        if not pdf_uploaded:
-            logger.error("Failed to upload PDF to storage")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to upload PDF to storage"
+        if pdf_exists and image_exists:
+            logger.info("PDF already processed, reusing ID: %s", file_processing_id)
+            return FileProcessingResponse.model_construct(
+                file_processing_id=file_processing_id,
+                pdf_path=pdf_path,
+                image_path=image_path,
+                original_filename=file.filename,
+                message="PDF processed successfully"
             )
         
-        logger.info(f"PDF uploaded successfully: {pdf_path}")
-        
-        # Extract first page as image
-        logger.debug("Extracting first page as image...")
+        # Validate PDF and extract first page with a single parse (CPU-bound, off the event loop)
+        logger.debug("Validating PDF and extracting first page as image...")
         try:
-            image_data = pdf_service.extract_first_page_as_image(pdf_data)
-            logger.debug(f"Image extracted, size: {len(image_data)} bytes")
+            is_valid, image_data = await asyncio.to_thread(
+                pdf_service.validate_and_render_first_page, pdf_data
+            )
         except Exception as e:
-            logger.error(f"Failed to extract first page: {str(e)}", exc_info=True)
+            logger.error("Failed to extract first page: %s", e, exc_info=True)
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to extract first page: {str(e)}"
             )
         
-        # Upload image to object storage
-        logger.debug("Uploading image to storage...")
-        image_uploaded = storage_service.upload_file(
-            file_data=image_data,
-            object_name=image_path,
-            content_type="image/png"
-        )
-        
-        if not image_uploaded:
-            logger.error("Failed to upload image to storage")
+        if not is_valid:
+            logger.error("PDF validation failed")
             raise HTTPException(
-                status_code=500,
-                detail="Failed to upload image to storage"
+                status_code=400,
+                detail="Invalid PDF file"
             )
         
-        logger.info(f"Image uploaded successfully: {image_path}")
-        logger.info(f"PDF processing completed for ID: {file_processing_id}")
+        logger.debug("Image extracted, size: %d bytes", len(image_data))
+        
+        # Upload PDF and image to object storage concurrently (raises StorageUnavailableError on failure)
+        logger.debug("Uploading PDF and image to storage...")
+        await asyncio.gather(
+            asyncio.to_thread(
+                storage_service.upload_file,
+                file_data=pdf_data,
+                object_name=pdf_path,
+                content_type="application/pdf"
+            ),
+            asyncio.to_thread(
+                storage_service.upload_file,
+                file_data=image_data,
+                object_name=image_path,
+                content_type="image/png"
+            )
+        )
+        
+        logger.info("PDF uploaded successfully: %s", pdf_path)
+        logger.info("Image uploaded successfully: %s", image_path)
+        
+        # Write the rendered preview through to the local cache; the ID is the content
+        # hash, so the first preview download is served without fetching from RustFS
+        try:
+            await asyncio.to_thread(cache_service.put, image_path, image_data, extension=".png")
+        except OSError as e:
+            logger.warning("Failed to cache preview image %s: %s", image_path, e)
+        
+        logger.info("PDF processing completed for ID: %s", file_processing_id)
         
-        return FileProcessingResponse(
+        # 字段均为本地生成的字符串，跳过入站校验
+        return FileProcessingResponse.model_construct(
             file_processing_id=file_processing_id,
             pdf_path=pdf_path,
             image_path=image_path,
@@ -110,10 +139,10 @@ async def upload_pdf(file: UploadFile = File(...)):
             message="PDF processed successfully"
         )
         
-    except HTTPException:
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during PDF processing: {str(e)}", exc_info=True)
+        logger.error("Unexpected error during PDF processing: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred during processing: {str(e)}"
@@ -126,7 +155,8 @@ async def upload_pdf(file: UploadFile = File(...)):
 async def upload_pdf_put(file: UploadFile = File(...)):
     """
     Upload a PDF file using PUT method (idempotent operation).
-    Same functionality as POST /upload - creates a new processing ID each time.
+    Same functionality as POST /upload - the processing ID is derived from the PDF
+    content, so uploading the same bytes again returns the existing ID.
     
     Args:
         file: PDF file to upload
@@ -144,102 +174,132 @@ async def health_check():
     return {"status": "healthy", "service": "PDF Processing API"}
 
 
+def _content_disposition(filename: str) -> str:
+    """构造 Content-Disposition 头 (与 FileResponse 一致，非 ASCII 文件名使用 RFC 5987 编码)"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+async def _serve_cached_file(
+    file_path: str,
+    extension: str,
+    media_type: str,
+    filename: str,
+    not_found_detail: str,
+    redirect: bool = False
+):
+    """
+    优先从本地缓存返回文件，未命中时从 RustFS 流式转发并同时写入缓存
+    
+    Args:
+        file_path: 对象存储中的文件路径
+        extension: 缓存文件扩展名
+        media_type: 响应的 MIME 类型
+        filename: 下载时的文件名
+        not_found_detail: 文件不存在时的错误信息
+        redirect: 为 True 时返回 307 重定向到预签名 URL，由客户端直接从 RustFS 下载
+        
+    Returns:
+        RedirectResponse (重定向)、FileResponse (缓存命中) 或 StreamingResponse (缓存未命中)
+    """
+    # 0. 客户端要求直连对象存储：不经过本服务转发文件内容
+    if redirect:
+        url = await asyncio.to_thread(
+            storage_service.generate_presigned_url,
+            object_name=file_path,
+            expiration=_REDIRECT_URL_EXPIRATION,
+            content_disposition=_content_disposition(filename)
+        )
+        if url:
+            return RedirectResponse(url, status_code=307)
+        logger.warning("Presigned URL unavailable for %s, falling back to proxying", file_path)
+    
+    # 1. 尝试从缓存获取
+    cached_file = cache_service.get(file_path, extension=extension)
+    if cached_file:
+        logger.info("Serving from cache: %s", file_path)
+        return FileResponse(cached_file, media_type=media_type, filename=filename)
+    
+    # 2. 从 RustFS 流式下载
+    logger.info("Streaming from RustFS: %s", file_path)
+    stream = await asyncio.to_thread(storage_service.iter_file, file_path)
+    
+    if not stream:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    
+    chunks, size = stream
+    
+    # 3. 边写缓存边返回，不在内存中缓冲整个文件
+    return StreamingResponse(
+        cache_service.put_stream(file_path, chunks, size, extension=extension),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": _content_disposition(filename),
+            "Content-Length": str(size)
+        }
+    )
+
+
 @router.get("/files/{processing_id}/pdf")
-async def get_original_pdf(processing_id: str, filename: str = None):
+async def get_original_pdf(processing_id: str, filename: str = None, redirect: bool = False):
     """
     下载原始 PDF 文件（带缓存）
     
     Args:
         processing_id: 文件处理 ID
         filename: 可选的原始文件名（用于下载时的文件名）
+        redirect: 为 True 时 307 重定向到预签名 URL，直接从 RustFS 下载
         
     Returns:
         PDF 文件流，优先从缓存读取
     """
     try:
-        file_path = f"{processing_id}/original.pdf"
-        
         # 如果没有提供文件名，使用默认文件名
         download_filename = filename if filename else f"{processing_id}.pdf"
-        logger.debug(f"Download filename: {download_filename}")
-        
-        # 1. 尝试从缓存获取
-        cached_file = cache_service.get(file_path, extension=".pdf")
-        if cached_file:
-            logger.info(f"Serving PDF from cache: {processing_id}")
-            return FileResponse(
-                cached_file,
-                media_type="application/pdf",
-                filename=download_filename
-            )
-        
-        # 2. 从 RustFS 下载
-        logger.info(f"Downloading PDF from RustFS: {processing_id}")
-        file_data = storage_service.download_file(file_path)
-        
-        if not file_data:
-            raise HTTPException(status_code=404, detail="PDF file not found")
+        logger.debug("Download filename: %s", download_filename)
         
-        # 3. 写入缓存
-        cached_file = cache_service.put(file_path, file_data, extension=".pdf")
-        
-        # 4. 返回文件
-        return FileResponse(
-            cached_file,
+        return await _serve_cached_file(
+            file_path=f"{processing_id}/original.pdf",
+            extension=".pdf",
             media_type="application/pdf",
-            filename=download_filename
+            filename=download_filename,
+            not_found_detail="PDF file not found",
+            redirect=redirect
         )
         
-    except HTTPException:
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
-        logger.error(f"Error downloading PDF: {str(e)}")
+        logger.error("Error downloading PDF: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get PDF: {str(e)}")
 
 
 @router.get("/files/{processing_id}/preview")
-async def get_preview_image(processing_id: str):
+async def get_preview_image(processing_id: str, redirect: bool = False):
     """
     下载首页预览图（带缓存）
     
     Args:
         processing_id: 文件处理 ID
+        redirect: 为 True 时 307 重定向到预签名 URL，直接从 RustFS 下载
         
     Returns:
         PNG 图片流，优先从缓存读取
     """
     try:
-        file_path = f"{processing_id}/first_page.png"
-        
-        # 1. 尝试从缓存获取
-        cached_file = cache_service.get(file_path, extension=".png")
-        if cached_file:
-            logger.info(f"Serving preview from cache: {processing_id}")
-            return FileResponse(
-                cached_file,
-                media_type="image/png",
-                filename=f"{processing_id}_preview.png"
-            )
-        
-        # 2. 从 RustFS 下载
-        logger.info(f"Downloading preview from RustFS: {processing_id}")
-        file_data = storage_service.download_file(file_path)
-        
-        if not file_data:
-            raise HTTPException(status_code=404, detail="Preview image not found")
-        
-        # 3. 写入缓存
-        cached_file = cache_service.put(file_path, file_data, extension=".png")
-        
-        # 4. 返回文件
-        return FileResponse(
-            cached_file,
+        return await _serve_cached_file(
+            file_path=f"{processing_id}/first_page.png",
+            extension=".png",
             media_type="image/png",
-            filename=f"{processing_id}_preview.png"
+            filename=f"{processing_id}_preview.png",
+            not_found_detail="Preview image not found",
+            redirect=redirect
         )
         
-    except HTTPException:
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
-        logger.error(f"Error downloading preview: {str(e)}")
+        logger.error("Error downloading preview: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get preview: {str(e)}")
@@ -1,12 +1,96 @@
 import os
 import time
 import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 正在写入的缓存文件后缀
+_TMP_SUFFIX = ".tmp"
+
+
+@lru_cache(maxsize=4096)
+def _hash_file_path(file_path: str) -> str:
+    """计算文件路径的缓存键 (非加密用途，BLAKE2b 比 MD5 更快)，同一路径的结果会被缓存"""
+    return hashlib.blake2b(file_path.encode(), digest_size=16).hexdigest()
+
+
+class LRUIndex:
+    """缓存文件的内存 LRU 索引，记录每个文件的大小和写入时间，并维护缓存总大小"""
+    
+    def __init__(self):
+        # 文件名 -> (大小, 写入时间)，按最近使用顺序排列 (最旧的在前)
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.total_size = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, name: str) -> Optional[Tuple[int, float]]:
+        """
+        获取索引项并标记为最近使用
+        
+        Args:
+            name: 缓存文件名
+            
+        Returns:
+            (大小, 写入时间)，不存在则返回 None
+        """
+        entry = self._entries.get(name)
+        if entry is not None:
+            self._entries.move_to_end(name)
+        return entry
+    
+    def add(self, name: str, size: int, mtime: float):
+        """
+        添加或更新索引项，并标记为最近使用
+        
+        Args:
+            name: 缓存文件名
+            size: 文件大小(字节)
+            mtime: 写入时间
+        """
+        self.remove(name)
+        self._entries[name] = (size, mtime)
+        self.total_size += size
+    
+    def remove(self, name: str) -> Optional[Tuple[int, float]]:
+        """
+        删除索引项
+        
+        Args:
+            name: 缓存文件名
+            
+        Returns:
+            被删除的 (大小, 写入时间)，不存在则返回 None
+        """
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.total_size -= entry[0]
+        return entry
+    
+    def pop_oldest(self) -> Tuple[str, int]:
+        """
+        弹出最久未使用的索引项
+        
+        Returns:
+            (文件名, 大小)
+        """
+        name, (size, _) = self._entries.popitem(last=False)
+        self.total_size -= size
+        return name, size
+    
+    def clear(self):
+        """清空索引"""
+        self._entries.clear()
+        self.total_size = 0
+
 
 class CacheService:
     def __init__(self, cache_dir: str, max_size_mb: int, ttl_seconds: int):
@@ -24,7 +108,32 @@ class CacheService:
         
         # 创建缓存目录
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Cache directory initialized: {self.cache_dir}")
+        
+        # 内存 LRU 索引，put() 时无需再扫描缓存目录
+        self._index = LRUIndex()
+        self._lock = threading.Lock()
+        self._rebuild_index()
+        
+        logger.info("Cache directory initialized: %s (%d files)", self.cache_dir, len(self._index))
+    
+    def _rebuild_index(self):
+        """从缓存目录重建 LRU 索引 (按修改时间近似最近使用顺序)，并清理残留的临时文件"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(_TMP_SUFFIX):
+                    # 上次进程退出时未写完的文件
+                    Path(entry.path).unlink(missing_ok=True)
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        
+        with self._lock:
+            self._index.clear()
+            for mtime, name, size in sorted(entries):
+                self._index.add(name, size, mtime)
     
     def _get_cache_key(self, file_path: str) -> str:
         """
@@ -34,9 +143,9 @@ class CacheService:
             file_path: 文件路径
             
         Returns:
-            缓存键 (MD5 hash)
+            缓存键 (BLAKE2b hash)
         """
-        return hashlib.md5(file_path.encode()).hexdigest()
+        return _hash_file_path(file_path)
     
     def _get_cache_file_path(self, cache_key: str, extension: str = "") -> Path:
         """
@@ -65,18 +174,32 @@ class CacheService:
         cache_key = self._get_cache_key(file_path)
         cache_file = self._get_cache_file_path(cache_key, extension)
         
-        if not cache_file.exists():
-            logger.debug(f"Cache miss: {file_path}")
+        # 每次都 stat 一次: 文件可能已被其他 worker 淘汰、clear() 或手动清理，
+        # 只信任内存索引会把已不存在的文件当作命中
+        try:
+            stat = cache_file.stat()
+        except FileNotFoundError:
+            with self._lock:
+                self._index.remove(cache_file.name)
+            logger.debug("Cache miss: %s", file_path)
             return None
         
+        entry = (stat.st_size, stat.st_mtime)
+        with self._lock:
+            # 更新 LRU 顺序；索引中没有或已过时 (其他进程写入) 时以磁盘为准
+            if self._index.get(cache_file.name) != entry:
+                self._index.add(cache_file.name, *entry)
+        
         # 检查是否过期
-        file_age = time.time() - cache_file.stat().st_mtime
+        file_age = time.time() - entry[1]
         if file_age > self.ttl_seconds:
-            logger.info(f"Cache expired: {file_path}")
-            cache_file.unlink()
+            logger.info("Cache expired: %s", file_path)
+            cache_file.unlink(missing_ok=True)
+            with self._lock:
+                self._index.remove(cache_file.name)
             return None
         
-        logger.debug(f"Cache hit: {file_path}")
+        logger.debug("Cache hit: %s", file_path)
         return cache_file
     
     def put(self, file_path: str, data: bytes, extension: str = "") -> Path:
@@ -97,43 +220,102 @@ class CacheService:
         cache_key = self._get_cache_key(file_path)
         cache_file = self._get_cache_file_path(cache_key, extension)
         
-        cache_file.write_bytes(data)
-        logger.info(f"File cached: {file_path} -> {cache_file}")
+        # 先写临时文件再原子重命名，进程中途被杀也不会留下半个缓存文件
+        # 缓存数据可随时从存储重新获取，因此不做 fsync
+        tmp_file, f = self._open_temp_file(cache_file)
+        try:
+            with f:
+                f.write(data)
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self._index.add(cache_file.name, len(data), time.time())
+        logger.info("File cached: %s -> %s", file_path, cache_file)
         
         return cache_file
     
-    def _ensure_space(self, required_bytes: int):
+    def put_stream(
+        self,
+        file_path: str,
+        chunks: Iterable[bytes],
+        size: int,
+        extension: str = ""
+    ) -> Iterator[bytes]:
         """
-        确保有足够的缓存空间
+        边转发数据流边写入缓存
+        
+        数据先写入临时文件，完整接收后再重命名为缓存文件；
+        如果中途中断则删除临时文件，不会留下不完整的缓存。
         
         Args:
-            required_bytes: 需要的空间大小(字节)
+            file_path: 原始文件路径
+            chunks: 数据块迭代器
+            size: 数据总大小(字节)
+            extension: 文件扩展名
+            
+        Yields:
+            原始数据块
         """
-        current_size = self._get_cache_size()
+        # 检查并清理缓存空间
+        self._ensure_space(size)
         
-        if current_size + required_bytes <= self.max_size_bytes:
-            return
+        cache_key = self._get_cache_key(file_path)
+        cache_file = self._get_cache_file_path(cache_key, extension)
+        tmp_file, f = self._open_temp_file(cache_file)
         
-        logger.info("Cache size exceeded, cleaning old files...")
+        completed = False
+        try:
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_file, cache_file)
+            completed = True
+            with self._lock:
+                self._index.add(cache_file.name, size, time.time())
+            logger.info("File cached: %s -> %s", file_path, cache_file)
+        finally:
+            if not completed:
+                tmp_file.unlink(missing_ok=True)
+    
+    def _open_temp_file(self, cache_file: Path) -> Tuple[Path, BinaryIO]:
+        """
+        为缓存文件创建唯一的临时文件，同一键的并发写入各自使用自己的临时文件
         
-        # 获取所有缓存文件并按修改时间排序
-        cache_files = sorted(
-            self.cache_dir.glob("*"),
-            key=lambda p: p.stat().st_mtime
+        Args:
+            cache_file: 最终的缓存文件路径
+            
+        Returns:
+            (临时文件路径, 以二进制写模式打开的文件对象)
+        """
+        fd, tmp_name = tempfile.mkstemp(
+            dir=self.cache_dir,
+            prefix=cache_file.name + ".",
+            suffix=_TMP_SUFFIX
         )
+        return Path(tmp_name), os.fdopen(fd, "wb")
+    
+    def _ensure_space(self, required_bytes: int):
+        """
+        确保有足够的缓存空间，按 LRU 顺序淘汰最久未使用的文件
         
-        # 删除最旧的文件直到有足够空间
-        for file in cache_files:
-            if current_size + required_bytes <= self.max_size_bytes:
-                break
+        Args:
+            required_bytes: 需要的空间大小(字节)
+        """
+        with self._lock:
+            if self._index.total_size + required_bytes <= self.max_size_bytes:
+                return
+            
+            logger.info("Cache size exceeded, evicting least recently used files...")
             
-            if not file.is_file():
-                continue
-                
-            file_size = file.stat().st_size
-            file.unlink()
-            current_size -= file_size
-            logger.debug(f"Removed old cache file: {file}")
+            # 删除最久未使用的文件直到有足够空间
+            while self._index and self._index.total_size + required_bytes > self.max_size_bytes:
+                name, _ = self._index.pop_oldest()
+                file = self.cache_dir / name
+                file.unlink(missing_ok=True)
+                logger.debug("Removed old cache file: %s", file)
     
     def _get_cache_size(self) -> int:
         """
@@ -142,27 +324,32 @@ class CacheService:
         Returns:
             缓存大小(字节)
         """
-        return sum(f.stat().st_size for f in self.cache_dir.glob("*") if f.is_file())
+        with self._lock:
+            return self._index.total_size
     
     def clear(self):
         """清空所有缓存"""
-        for file in self.cache_dir.glob("*"):
-            if file.is_file():
-                file.unlink()
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    os.unlink(entry.path)
+        with self._lock:
+            self._index.clear()
         logger.info("Cache cleared")
     
     def get_stats(self) -> dict:
         """
-        获取缓存统计信息
+        获取缓存统计信息 (直接读取内存索引，不扫描缓存目录)
         
         Returns:
             缓存统计信息
         """
-        files = list(self.cache_dir.glob("*"))
-        total_size = sum(f.stat().st_size for f in files if f.is_file())
+        with self._lock:
+            total_files = len(self._index)
+            total_size = self._index.total_size
         
         return {
-            "total_files": len([f for f in files if f.is_file()]),
+            "total_files": total_files,
             "total_size_mb": round(total_size / (1024 * 1024), 2),
             "max_size_mb": self.max_size_bytes / (1024 * 1024),
             "usage_percent": round((total_size / self.max_size_bytes) * 100, 2) if self.max_size_bytes > 0 else 0
@@ -1,11 +1,17 @@
 """Dify chatflow service for document processing"""
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+import time
+import orjson
+from typing import Dict, Any, Optional, Sequence, Tuple
 from dify_client import AsyncChatClient
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 对话变量查找表的缓存时间 (秒)
+_VARIABLES_TTL = 30.0
+
 
 class DifyService:
     """Service for interacting with Dify chatflow"""
@@ -16,13 +22,44 @@ class DifyService:
         self.base_url = settings.dify_base_url
         self.app_id = settings.dify_app_id
         
+        # (conversation_id, user_id) -> (过期时间, {变量名: 变量对象})
+        self._variables_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+        
+        # 共享的 AsyncChatClient (及其 httpx 连接池), 首次使用时创建
+        self._client: Optional[AsyncChatClient] = None
+        self._client_lock = asyncio.Lock()
+        
         # 验证配置
         if not self.api_key:
             logger.warning("Dify API key is not configured. Please set DIFY_API_KEY in .env file")
         else:
-            logger.info(f"Dify service initialized with base_url: {self.base_url}")
+            logger.info("Dify service initialized with base_url: %s", self.base_url)
             if self.app_id:
-                logger.info(f"Using Dify App ID: {self.app_id}")
+                logger.info("Using Dify App ID: %s", self.app_id)
+    
+    async def client(self) -> AsyncChatClient:
+        """
+        获取共享的 AsyncChatClient, 首次调用时创建并进入其上下文
+        
+        Returns:
+            长期复用的 AsyncChatClient 实例
+        """
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    client = AsyncChatClient(api_key=self.api_key)
+                    await client.__aenter__()
+                    # Set base_url if different from default
+                    if self.base_url:
+                        client.base_url = self.base_url
+                    self._client = client
+        return self._client
+    
+    async def close(self) -> None:
+        """关闭共享的 AsyncChatClient (应用关闭时调用)"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.__aexit__(None, None, None)
     
     async def extract_variable(
         self,
@@ -44,7 +81,7 @@ class DifyService:
             变量值,如果未找到则返回 None
         """
         if not conversation_id:
-            logger.warning(f"Cannot extract '{variable_name}': conversation_id is empty")
+            logger.warning("Cannot extract '%s': conversation_id is empty", variable_name)
             return None
         
         value = await self._get_variable_from_api(
@@ -55,21 +92,21 @@ class DifyService:
         )
         
         if value is not None:
-            logger.info(f"Successfully extracted '{variable_name}' from conversation variables API")
+            logger.info("Successfully extracted '%s' from conversation variables API", variable_name)
             return value
         
-        logger.warning(f"Variable '{variable_name}' not found in conversation variables")
+        logger.warning("Variable '%s' not found in conversation variables", variable_name)
         return None
     
     async def extract_multiple_variables(
         self,
         client: AsyncChatClient,
         conversation_id: str,
-        variable_names: list[str],
+        variable_names: Sequence[str],
         user_id: str
     ) -> Dict[str, Any]:
         """
-        批量提取多个 Dify 对话变量
+        批量提取多个 Dify 对话变量 (只调用一次 conversation variables API)
         
         Args:
             client: AsyncChatClient 实例
@@ -80,68 +117,116 @@ class DifyService:
         Returns:
             包含所有成功提取变量的字典 {variable_name: value}
         """
-        extracted = {}
+        if not conversation_id:
+            logger.warning("Cannot extract %s: conversation_id is empty", list(variable_names))
+            return {}
         
+        by_name = await self._get_variables_by_name(
+            client=client,
+            conversation_id=conversation_id,
+            user_id=user_id
+        )
+        
+        extracted = {}
         for var_name in variable_names:
-            value = await self.extract_variable(
-                client=client,
-                conversation_id=conversation_id,
-                variable_name=var_name,
-                user_id=user_id
-            )
+            var = by_name.get(var_name)
+            if var is None:
+                logger.warning("Variable '%s' not found in conversation variables", var_name)
+                continue
+            value = self._parse_variable_value(var)
             if value is not None:
                 extracted[var_name] = value
         
-        logger.info(f"Successfully extracted {len(extracted)}/{len(variable_names)} variables: {list(extracted.keys())}")
+        logger.info("Successfully extracted %d/%d variables: %s", len(extracted), len(variable_names), list(extracted))
         return extracted
     
-    async def _get_variable_from_api(
+    async def _get_variables_by_name(
         self,
         client: AsyncChatClient,
         conversation_id: str,
-        variable_name: str,
         user_id: str
-    ) -> Optional[Any]:
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        从 Dify conversation variables API 获取变量
+        获取对话变量的 {变量名: 变量对象} 查找表
+        
+        同一对话、同一用户的查找表缓存 _VARIABLES_TTL 秒, 重复提取不会再次请求 API;
+        process_document 发送新消息后会丢弃对应的缓存
         
         Args:
             client: AsyncChatClient 实例
             conversation_id: 对话 ID
-            variable_name: 变量名
             user_id: 用户 ID
             
         Returns:
-            变量值,如果未找到或出错则返回 None
+            变量查找表,出错时返回空字典 (不缓存)
         """
+        cache_key = (conversation_id, user_id)
+        now = time.monotonic()
+        cached = self._variables_cache.get(cache_key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        
         try:
-            logger.info(f"Fetching conversation variables for: {conversation_id}")
+            logger.info("Fetching conversation variables for: %s", conversation_id)
             variables_response = await client.get_conversation_variables(
                 conversation_id=conversation_id,
                 user=user_id
             )
             variables_response.raise_for_status()
-            variables_data = variables_response.json()
+            variables_data = orjson.loads(variables_response.content)
             
-            logger.debug(f"Conversation variables response: {variables_data}")
+            logger.debug("Conversation variables response: %s", variables_data)
             
-            # 从返回的变量列表中查找指定变量
             # 返回格式: {"data": [{"name": "...", "value": "...", "value_type": "..."}], "has_more": false}
-            if 'data' in variables_data:
-                variables_list = variables_data['data']
-                if isinstance(variables_list, list):
-                    for var in variables_list:
-                        if var.get('name') == variable_name:
-                            value = self._parse_variable_value(var)
-                            logger.debug(f"Found '{variable_name}' with value_type: {var.get('value_type')}")
-                            return value
+            variables_list = variables_data.get('data')
+            if not isinstance(variables_list, list):
+                return {}
             
-            logger.debug(f"Variable '{variable_name}' not found in conversation variables")
+            name_to_var = {var.get('name'): var for var in variables_list}
             
         except Exception as e:
-            logger.error(f"Failed to get conversation variables: {str(e)}", exc_info=True)
+            logger.error("Failed to get conversation variables: %s", e, exc_info=True)
+            return {}
         
-        return None
+        # 顺便清理已过期的对话, 避免缓存无限增长
+        self._variables_cache = {
+            key: entry for key, entry in self._variables_cache.items() if entry[0] > now
+        }
+        self._variables_cache[cache_key] = (now + _VARIABLES_TTL, name_to_var)
+        return name_to_var
+    
+    async def _get_variable_from_api(
+        self,
+        client: AsyncChatClient,
+        conversation_id: str,
+        variable_name: str,
+        user_id: str
+    ) -> Optional[Any]:
+        """
+        从 Dify conversation variables API 获取变量
+        
+        Args:
+            client: AsyncChatClient 实例
+            conversation_id: 对话 ID
+            variable_name: 变量名
+            user_id: 用户 ID
+            
+        Returns:
+            变量值,如果未找到或出错则返回 None
+        """
+        name_to_var = await self._get_variables_by_name(
+            client=client,
+            conversation_id=conversation_id,
+            user_id=user_id
+        )
+        
+        var = name_to_var.get(variable_name)
+        if var is None:
+            logger.debug("Variable '%s' not found in conversation variables", variable_name)
+            return None
+        
+        logger.debug("Found '%s' with value_type: %s", variable_name, var.get('value_type'))
+        return self._parse_variable_value(var)
     
     @staticmethod
     def _parse_variable_value(var: Dict[str, Any]) -> Any:
@@ -159,11 +244,10 @@ class DifyService:
         
         # 如果是 JSON 类型且值为字符串,尝试解析
         if value_type == 'json' and isinstance(value, str):
-            import json
             try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse JSON value: {value[:100]}...")
+                return orjson.loads(value)
+            except orjson.JSONDecodeError:
+                logger.warning("Failed to parse JSON value: %s...", value[:100])
                 return value
         
         return value
@@ -207,56 +291,55 @@ class DifyService:
                 "front_page": file
             }
             
-            logger.info(f"Sending document to Dify: {preview_url}")
-            logger.debug(f"Query: {query}, User: {user_id}")
+            logger.info("Sending document to Dify: %s", preview_url)
+            logger.debug("Query: %s, User: %s", query, user_id)
+            
+            client = await self.client()
+            
+            # 发送消息
+            response = await client.create_chat_message(
+                inputs=inputs,
+                query=query,
+                user=user_id,
+                response_mode="blocking"
+            )
+            
+            # Raise for HTTP errors
+            response.raise_for_status()
+            
+            # Parse JSON response
+            result = orjson.loads(response.content)
+            
+            logger.info("Dify response received successfully")
+            logger.debug("Full response: %s", result)
             
-            # Use async context manager for proper resource cleanup
-            async with AsyncChatClient(api_key=self.api_key) as client:
-                # Set base_url if different from default
-                if self.base_url:
-                    client.base_url = self.base_url
-                
-                # 发送消息
-                response = await client.create_chat_message(
-                    inputs=inputs,
-                    query=query,
-                    user=user_id,
-                    response_mode="blocking"
-                )
-                
-                # Raise for HTTP errors
-                response.raise_for_status()
-                
-                # Parse JSON response
-                result = response.json()
-                
-                logger.info(f"Dify response received successfully")
-                logger.debug(f"Full response: {result}")
-                
-                # 获取 conversation_id
-                conversation_id = result.get('conversation_id')
-                
-                # 从 conversation variables API 提取变量
-                confirmation_record = await self.extract_variable(
-                    client=client,
-                    conversation_id=conversation_id,
-                    variable_name='confirmation_record',
-                    user_id=user_id
-                )
-                
-                return {
-                    "success": True,
-                    "answer": result.get('answer', ''),
-                    "confirmation_record": confirmation_record,
-                    "conversation_id": result.get('conversation_id'),
-                    "message_id": result.get('id'),
-                    "metadata": result.get('metadata', {}),
-                    "created_at": result.get('created_at')
-                }
+            # 获取 conversation_id
+            conversation_id = result.get('conversation_id')
+            
+            # 新的一轮对话会更新变量: 丢弃之前缓存的查找表, 保证读到本轮的值
+            self._variables_cache.pop((conversation_id, user_id), None)
+            
+            # 从 conversation variables API 提取变量
+            confirmation_record = await self.extract_variable(
+                client=client,
+                conversation_id=conversation_id,
+                variable_name='confirmation_record',
+                user_id=user_id
+            )
+            
+            return {
+                "success": True,
+                "answer": result.get('answer', ''),
+                "confirmation_record": confirmation_record,
+                "conversation_id": result.get('conversation_id'),
+                "message_id": result.get('id'),
+                "metadata": result.get('metadata', {}),
+                "created_at": result.get('created_at')
+            }
             
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Error processing document with Dify: {error_msg}", exc_info=True)
+            logger.error("Error processing document with Dify: %s", error_msg, exc_info=True)
             
             # 提供更友好的错误信息
             if "401" in error_msg or "Unauthorized" in error_msg:
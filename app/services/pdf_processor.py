@@ -1,46 +1,164 @@
-import io
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple, Union
 import fitz  # PyMuPDF
-from PIL import Image
+
+
+# Content types accepted as PDF uploads
+_PDF_MIMES = frozenset({
+    "application/pdf",
+    "application/x-pdf",
+    "application/acrobat",
+    "application/vnd.pdf",
+})
+
+# Quality used when encoding rendered pages as JPEG
+_JPEG_QUALITY = 85
+
+
+@lru_cache(maxsize=8)
+def _matrix(dpi: int) -> fitz.Matrix:
+    """Zoom matrix for rendering at the given DPI (PDF user space is 72 DPI)"""
+    zoom = dpi / 72
+    return fitz.Matrix(zoom, zoom)
 
 
 class PDFProcessingService:
     """Service for PDF processing operations"""
     
     @staticmethod
-    def extract_first_page_as_image(pdf_data: bytes, dpi: int = 150) -> bytes:
+    def is_pdf_content_type(content_type: Optional[str]) -> bool:
+        """
+        Check whether an upload's Content-Type denotes a PDF
+        
+        Args:
+            content_type: Raw Content-Type header value, may include parameters
+            
+        Returns:
+            True if the media type is a known PDF MIME type, False otherwise
+        """
+        return (content_type or "").split(";", 1)[0].strip().lower() in _PDF_MIMES
+    
+    @staticmethod
+    def content_digest(pdf_data: bytes) -> str:
         """
-        Extract the first page of a PDF as a PNG image
+        Compute a content-addressed identifier for a PDF
         
         Args:
             pdf_data: PDF file content as bytes
-            dpi: Resolution for the image (default: 150)
             
         Returns:
-            PNG image data as bytes
+            32-character hex BLAKE2b digest of the content
         """
-        # Open PDF from bytes
-        pdf_document = fitz.open(stream=pdf_data, filetype="pdf")
+        return hashlib.blake2b(pdf_data, digest_size=16).hexdigest()
+    
+    @staticmethod
+    def _render_page(page: fitz.Page, dpi: int, image_format: str = "png") -> bytes:
+        """
+        Render a single page as an image
         
-        if pdf_document.page_count == 0:
-            pdf_document.close()
-            raise ValueError("PDF document has no pages")
+        Args:
+            page: Page of an open PDF document
+            dpi: Resolution for the image
+            image_format: "png" (lossless) or "jpeg" (smaller and faster to encode)
+            
+        Returns:
+            Encoded image data as bytes
+        """
+        # Render page to an RGB pixmap; pages are opaque so no alpha channel is needed
+        pix = page.get_pixmap(matrix=_matrix(dpi), alpha=False)
         
-        # Get first page
-        first_page = pdf_document[0]
+        # Encode pixmap
+        if image_format == "jpeg":
+            return pix.tobytes("jpg", jpg_quality=_JPEG_QUALITY)
+        return pix.tobytes("png")
+    
+    @staticmethod
+    def _open_document(src: Union[bytes, str, Path]) -> fitz.Document:
+        """
+        Open a PDF from memory or from a file on disk
         
-        # Calculate zoom factor from DPI (default is 72 DPI)
-        zoom = dpi / 72
-        mat = fitz.Matrix(zoom, zoom)
+        Args:
+            src: PDF content as bytes, or path to a PDF file (e.g. a cached original)
+            
+        Returns:
+            Opened PyMuPDF document
+        """
+        if isinstance(src, (str, Path)):
+            # Let MuPDF read the file directly instead of copying it through Python
+            return fitz.open(str(src), filetype="pdf")
+        return fitz.open(stream=src, filetype="pdf")
+    
+    @staticmethod
+    def extract_first_page_as_image(
+        src: Union[bytes, str, Path],
+        dpi: int = 150,
+        image_format: str = "png"
+    ) -> bytes:
+        """
+        Extract the first page of a PDF as an image
         
-        # Render page to pixmap
-        pix = first_page.get_pixmap(matrix=mat)
+        Args:
+            src: PDF file content as bytes, or path to a PDF file on disk
+            dpi: Resolution for the image (default: 150)
+            image_format: "png" (default) or "jpeg"
+            
+        Returns:
+            Encoded image data as bytes
+        """
+        with PDFProcessingService._open_document(src) as pdf_document:
+            if pdf_document.page_count == 0:
+                raise ValueError("PDF document has no pages")
+            
+            return PDFProcessingService._render_page(pdf_document[0], dpi, image_format)
+    
+    @staticmethod
+    def validate_and_render_first_page(
+        pdf_data: bytes,
+        dpi: int = 150,
+        image_format: str = "png"
+    ) -> Tuple[bool, bytes]:
+        """
+        Validate a PDF and render its first page as an image, parsing the document only once
+        
+        Args:
+            pdf_data: PDF file content as bytes
+            dpi: Resolution for the image (default: 150)
+            image_format: "png" (default) or "jpeg"
+            
+        Returns:
+            (True, image data) if the PDF is valid, (False, b"") otherwise
+            
+        Raises:
+            Exception: If the PDF is valid but rendering the first page fails
+        """
+        if not PDFProcessingService.validate_pdf_header(pdf_data):
+            return False, b""
         
-        # Convert pixmap to PNG bytes
-        png_data = pix.tobytes("png")
+        try:
+            pdf_document = fitz.open(stream=pdf_data, filetype="pdf")
+        except Exception:
+            return False, b""
         
-        pdf_document.close()
+        with pdf_document:
+            if pdf_document.page_count == 0:
+                return False, b""
+            
+            return True, PDFProcessingService._render_page(pdf_document[0], dpi, image_format)
+    
+    @staticmethod
+    def validate_pdf_header(header: bytes) -> bool:
+        """
+        Check the PDF magic bytes without parsing the document
         
-        return png_data
+        Args:
+            header: Leading bytes of the file (at least 4 bytes)
+            
+        Returns:
+            True if the data starts with the PDF signature, False otherwise
+        """
+        return header[:4] == b'%PDF'
     
     @staticmethod
     def validate_pdf(pdf_data: bytes) -> bool:
@@ -55,15 +173,12 @@ class PDFProcessingService:
         """
         try:
             # Try to read the PDF header
-            if pdf_data[:4] != b'%PDF':
+            if not PDFProcessingService.validate_pdf_header(pdf_data):
                 return False
             
-            # Try to open the PDF to verify it's valid
-            pdf_document = fitz.open(stream=pdf_data, filetype="pdf")
-            page_count = pdf_document.page_count
-            pdf_document.close()
-            
-            return page_count > 0
+            # Parse the document structure only (no rendering) to verify it's valid
+            with fitz.open(stream=pdf_data, filetype="pdf") as pdf_document:
+                return pdf_document.page_count > 0
         except Exception:
             return False
 
@@ -1,27 +1,90 @@
 import io
-from typing import Optional
+import logging
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple, Union
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+_GB = 1024 * _MB
+
+# S3 allows at most this many parts per multipart upload
+_MAX_PARTS = 10_000
+
+# How long a HEAD result is trusted, and how many object keys are remembered
+_EXISTS_TTL = 5.0
+_EXISTS_MAX_ENTRIES = 10_000
+
+# Largest object a single CopyObject request may copy (S3 limit)
+_MAX_SINGLE_COPY = 5 * 1024 * _MB
+
+# Upper bound on memoized presigned URLs
+_URL_CACHE_MAX_ENTRIES = 10_000
+
+# Error codes S3 uses for a missing key (HEAD only reports the status code)
+_NOT_FOUND_CODES = frozenset({'404', 'NoSuchKey', 'NotFound'})
+
+
+class StorageUnavailableError(Exception):
+    """Object storage failed for a reason other than a missing object (after client retries)"""
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Whether a boto3 error means the requested object does not exist"""
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in _NOT_FOUND_CODES
+
 
 class ObjectStorageService:
     """Service for interacting with RustFS object storage using boto3"""
     
     def __init__(self):
+        # One client per process: its urllib3 pool is shared by all request threads,
+        # so keep it large enough for concurrent to_thread calls and keep sockets warm
         self.s3_client = boto3.client(
             's3',
             endpoint_url=settings.rustfs_endpoint,
             aws_access_key_id=settings.rustfs_access_key,
             aws_secret_access_key=settings.rustfs_secret_key,
-            config=Config(signature_version='s3v4'),
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=settings.rustfs_max_pool_connections,
+                tcp_keepalive=True,
+                # Adaptive mode backs off on 5xx/throttling and rate-limits client-side
+                retries={'mode': 'adaptive', 'max_attempts': 5}
+            ),
             region_name=settings.rustfs_region
         )
         self.bucket_name = settings.rustfs_bucket_name
-        self._ensure_bucket_exists()
+        self._base_url = f"{settings.rustfs_endpoint.rstrip('/')}/{self.bucket_name}/"
+        # Baseline transfer settings; _config_for_size scales them up for huge objects.
+        # Anything below the threshold is sent as a single PutObject / GET.
+        # Always use the classic transfer manager: in boto3 1.34 the CRT client is built
+        # without our endpoint_url (so it would talk to AWS S3, not RustFS), ignores
+        # this TransferConfig, and raises awscrt errors instead of ClientError
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.rustfs_multipart_threshold_mb * _MB,
+            multipart_chunksize=settings.rustfs_multipart_chunksize_mb * _MB,
+            max_concurrency=settings.rustfs_max_concurrency,
+            use_threads=True,
+            preferred_transfer_client="classic"
+        )
+        # object_name -> (monotonic deadline, exists); coalesces repeated HEADs
+        self._exists_cache: Dict[str, Tuple[float, bool]] = {}
+        self._exists_lock = threading.Lock()
+        # (object_name, method, expiration, disposition, window) -> (url, monotonic deadline)
+        self._url_cache: Dict[Tuple[str, str, int, Optional[str], int], Tuple[str, float]] = {}
+        self._url_lock = threading.Lock()
+        # Creating the bucket is a deploy-time step; skip the HEAD on every worker start
+        if not settings.rustfs_skip_bucket_check:
+            self.ensure_bucket_exists()
     
-    def _ensure_bucket_exists(self):
+    def ensure_bucket_exists(self):
         """Create bucket if it doesn't exist"""
         try:
             self.s3_client.head_bucket(Bucket=self.bucket_name)
@@ -31,75 +94,288 @@ class ObjectStorageService:
                 # Bucket doesn't exist, create it
                 try:
                     self.s3_client.create_bucket(Bucket=self.bucket_name)
-                    print(f"Bucket {self.bucket_name} created successfully")
-                except ClientError as create_error:
-                    print(f"Error creating bucket: {create_error}")
+                    logger.info("Bucket %s created", self.bucket_name)
+                except ClientError:
+                    logger.exception("Error creating bucket %s", self.bucket_name)
                     raise
             else:
-                print(f"Error checking bucket: {e}")
+                logger.exception("Error checking bucket %s", self.bucket_name)
                 raise
     
+    def _config_for_size(self, size: int) -> TransferConfig:
+        """
+        Pick multipart part size and concurrency for a transfer of the given size
+        
+        Up to 1 GiB the configured baseline is used; 1-10 GiB uses 64 MiB parts and
+        >10 GiB 128 MiB parts with 32 threads, growing parts to stay within 10,000.
+        
+        Args:
+            size: Object size in bytes
+            
+        Returns:
+            TransferConfig for the transfer
+        """
+        base = self.transfer_config
+        if size <= _GB:
+            return base
+        
+        chunksize = 64 * _MB if size <= 10 * _GB else 128 * _MB
+        chunksize = max(chunksize, base.multipart_chunksize, -(-size // _MAX_PARTS))
+        return TransferConfig(
+            multipart_threshold=base.multipart_threshold,
+            multipart_chunksize=chunksize,
+            max_concurrency=max(32, base.max_concurrency),
+            use_threads=True,
+            preferred_transfer_client="classic"
+        )
+    
+    @staticmethod
+    def _remaining_size(file_obj: BinaryIO) -> Optional[int]:
+        """Bytes left to read in a seekable file object, or None if it can't be measured"""
+        try:
+            position = file_obj.tell()
+            end = file_obj.seek(0, io.SEEK_END)
+            file_obj.seek(position)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return end - position
+    
     def upload_file(
         self, 
-        file_data: bytes, 
+        file_data: Union[bytes, BinaryIO], 
         object_name: str, 
         content_type: str = "application/pdf"
     ) -> bool:
-        """Upload file to RustFS object storage"""
+        """
+        Upload file to RustFS object storage
+        
+        Args:
+            file_data: File content as bytes, or a readable binary file object
+                (e.g. UploadFile.file) that is streamed part by part
+            object_name: Object key in the bucket
+            content_type: MIME type stored with the object
+            
+        Returns:
+            True once the object is stored
+            
+        Raises:
+            StorageUnavailableError: If the upload still fails after retries
+        """
         try:
-            file_stream = io.BytesIO(file_data)
-            self.s3_client.upload_fileobj(
-                file_stream,
+            if not isinstance(file_data, (bytes, bytearray)):
+                # The transfer manager reads the stream in part-sized chunks and
+                # falls back to a single PutObject below the multipart threshold
+                size = self._remaining_size(file_data)
+                self.s3_client.upload_fileobj(
+                    file_data,
+                    self.bucket_name,
+                    object_name,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self.transfer_config if size is None else self._config_for_size(size)
+                )
+            elif len(file_data) < self.transfer_config.multipart_threshold:
+                # Skip the CreateMultipartUpload/CompleteMultipartUpload round-trips
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    Body=file_data,
+                    ContentType=content_type
+                )
+            else:
+                file_stream = io.BytesIO(file_data)
+                self.s3_client.upload_fileobj(
+                    file_stream,
+                    self.bucket_name,
+                    object_name,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self._config_for_size(len(file_data))
+                )
+            with self._exists_lock:
+                self._exists_cache.pop(object_name, None)
+            return True
+        except (ClientError, BotoCoreError) as e:
+            logger.exception("Error uploading file %s", object_name)
+            raise StorageUnavailableError(f"Failed to upload {object_name}") from e
+    
+    def download_file(self, object_name: str) -> Optional[bytes]:
+        """
+        Download file from RustFS object storage
+        
+        Objects above the multipart threshold are fetched as parallel ranged GETs
+        sized like the upload parts for that object size; smaller objects use a single GET.
+        
+        Args:
+            object_name: Object key in the bucket
+            
+        Returns:
+            File content as bytes or None if the object does not exist
+            
+        Raises:
+            StorageUnavailableError: If the download still fails after retries
+        """
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_name)
+            size = head['ContentLength']
+            if size < self.transfer_config.multipart_threshold:
+                response = self.s3_client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=object_name
+                )
+                return response['Body'].read()
+            
+            buffer = io.BytesIO()
+            self.s3_client.download_fileobj(
                 self.bucket_name,
                 object_name,
-                ExtraArgs={'ContentType': content_type}
+                buffer,
+                Config=self._config_for_size(size)
             )
-            return True
-        except ClientError as e:
-            print(f"Error uploading file: {e}")
-            return False
+            return buffer.getvalue()
+        except (ClientError, BotoCoreError) as e:
+            if _is_not_found(e):
+                logger.error("Error downloading file %s: %s", object_name, e)
+                return None
+            logger.exception("Error downloading file %s", object_name)
+            raise StorageUnavailableError(f"Failed to download {object_name}") from e
     
-    def download_file(self, object_name: str) -> Optional[bytes]:
-        """Download file from RustFS object storage"""
+    def iter_file(
+        self,
+        object_name: str,
+        chunk_size: int = 64 * 1024
+    ) -> Optional[Tuple[Iterator[bytes], int]]:
+        """
+        Open a streaming download from RustFS object storage
+        
+        Args:
+            object_name: Object key in the bucket
+            chunk_size: Size of each yielded chunk in bytes (default: 64 KiB)
+            
+        Returns:
+            Tuple of (chunk iterator, content length) or None if the object does not exist
+            
+        Raises:
+            StorageUnavailableError: If the request still fails after retries
+        """
         try:
             response = self.s3_client.get_object(
                 Bucket=self.bucket_name,
                 Key=object_name
             )
-            return response['Body'].read()
-        except ClientError as e:
-            print(f"Error downloading file: {e}")
-            return None
+        except (ClientError, BotoCoreError) as e:
+            if _is_not_found(e):
+                logger.error("Error downloading file %s: %s", object_name, e)
+                return None
+            logger.exception("Error downloading file %s", object_name)
+            raise StorageUnavailableError(f"Failed to download {object_name}") from e
+        
+        return self._iter_body(response['Body'], chunk_size), response['ContentLength']
+    
+    @staticmethod
+    def _iter_body(body, chunk_size: int) -> Iterator[bytes]:
+        """Yield chunks from a botocore StreamingBody and release the connection afterwards"""
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+    
+    def copy_object(self, src_key: str, dst_key: str) -> Optional[str]:
+        """
+        Copy an object inside the bucket without routing the bytes through this process
+        
+        Args:
+            src_key: Object key to copy from
+            dst_key: Object key to copy to
+            
+        Returns:
+            URL of the new object or None if the source does not exist
+            
+        Raises:
+            StorageUnavailableError: If the copy still fails after retries
+        """
+        copy_source = {'Bucket': self.bucket_name, 'Key': src_key}
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=src_key)
+            if head['ContentLength'] > _MAX_SINGLE_COPY:
+                # Managed copy issues UploadPartCopy requests in parallel
+                self.s3_client.copy(
+                    copy_source,
+                    self.bucket_name,
+                    dst_key,
+                    Config=self._config_for_size(head['ContentLength'])
+                )
+            else:
+                self.s3_client.copy_object(
+                    CopySource=copy_source,
+                    Bucket=self.bucket_name,
+                    Key=dst_key
+                )
+        except (ClientError, BotoCoreError) as e:
+            if _is_not_found(e):
+                logger.error("Error copying %s to %s: source not found", src_key, dst_key)
+                return None
+            logger.exception("Error copying %s to %s", src_key, dst_key)
+            raise StorageUnavailableError(f"Failed to copy {src_key} to {dst_key}") from e
+        
+        with self._exists_lock:
+            self._exists_cache.pop(dst_key, None)
+        return self.get_file_url(dst_key)
     
     def file_exists(self, object_name: str) -> bool:
         """
         Check if file exists in RustFS object storage
         
+        Results are remembered for a few seconds so bursts of checks for the
+        same object cost one HEAD request; a successful upload_file drops the entry.
+        
         Args:
             object_name: Object key in the bucket
             
         Returns:
-            True if file exists, False otherwise
+            True if file exists, False if S3 reports it missing
+            
+        Raises:
+            StorageUnavailableError: If the HEAD fails for any other reason (not cached)
         """
+        now = time.monotonic()
+        with self._exists_lock:
+            cached = self._exists_cache.get(object_name)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        
         try:
             self.s3_client.head_object(
                 Bucket=self.bucket_name,
                 Key=object_name
             )
-            return True
-        except ClientError:
-            return False
+            exists = True
+        except (ClientError, BotoCoreError) as e:
+            if not _is_not_found(e):
+                # 403/5xx/throttling/connection errors must not masquerade as "missing"
+                logger.exception("Error checking file %s", object_name)
+                raise StorageUnavailableError(f"Failed to check {object_name}") from e
+            exists = False
+        
+        with self._exists_lock:
+            if len(self._exists_cache) >= _EXISTS_MAX_ENTRIES:
+                self._exists_cache = {
+                    key: entry for key, entry in self._exists_cache.items() if entry[0] > now
+                }
+                if len(self._exists_cache) >= _EXISTS_MAX_ENTRIES:
+                    # Still full of live entries: drop the oldest one
+                    del self._exists_cache[next(iter(self._exists_cache))]
+            self._exists_cache[object_name] = (now + _EXISTS_TTL, exists)
+        return exists
     
     def get_file_url(self, object_name: str) -> str:
         """Get the URL for a file in object storage"""
-        endpoint = settings.rustfs_endpoint.rstrip('/')
-        return f"{endpoint}/{self.bucket_name}/{object_name}"
+        return self._base_url + object_name
     
     def generate_presigned_url(
         self, 
         object_name: str, 
         expiration: int = 600,
-        method: str = 'get_object'
+        method: str = 'get_object',
+        content_disposition: Optional[str] = None
     ) -> Optional[str]:
         """
         Generate a presigned URL for file access
@@ -108,21 +384,66 @@ class ObjectStorageService:
             object_name: Object key in the bucket
             expiration: URL expiration time in seconds (default: 600 = 10 minutes)
             method: 'get_object' for download, 'put_object' for upload
+            content_disposition: Optional Content-Disposition the storage should
+                send when the URL is fetched (get_object only)
             
         Returns:
             Presigned URL string or None if error
         """
+        # Reuse a signed URL for half its lifetime, so callers always get at least
+        # expiration/2 seconds of validity and repeated requests return the same URL
+        half_life = max(expiration // 2, 1)
+        key = (object_name, method, expiration, content_disposition, int(time.time() // half_life))
+        now = time.monotonic()
+        with self._url_lock:
+            cached = self._url_cache.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        
+        params = {'Bucket': self.bucket_name, 'Key': object_name}
+        if content_disposition:
+            params['ResponseContentDisposition'] = content_disposition
+        
         try:
             url = self.s3_client.generate_presigned_url(
                 ClientMethod=method,
-                Params={'Bucket': self.bucket_name, 'Key': object_name},
+                Params=params,
                 ExpiresIn=expiration
             )
-            return url
         except ClientError as e:
-            print(f"Error generating presigned URL: {e}")
+            logger.error("Error generating presigned URL for %s: %s", object_name, e)
             return None
+        
+        with self._url_lock:
+            if len(self._url_cache) >= _URL_CACHE_MAX_ENTRIES:
+                # Lazily drop URLs whose reuse window has passed
+                self._url_cache = {
+                    k: entry for k, entry in self._url_cache.items() if entry[1] > now
+                }
+                if len(self._url_cache) >= _URL_CACHE_MAX_ENTRIES:
+                    del self._url_cache[next(iter(self._url_cache))]
+            self._url_cache[key] = (url, now + half_life)
+        return url
 
 
 # Singleton instance
 storage_service = ObjectStorageService()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="RustFS object storage maintenance")
+    parser.add_argument(
+        "--ensure-bucket",
+        action="store_true",
+        help="create the configured bucket if it does not exist"
+    )
+    args = parser.parse_args()
+    
+    if args.ensure_bucket:
+        logging.basicConfig(level=logging.INFO)
+        storage_service.ensure_bucket_exists()
+        logger.info("Bucket %s is ready", storage_service.bucket_name)
+    else:
+        parser.print_help()
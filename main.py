@@ -1,34 +1,62 @@
 import logging
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import pdf, dify
-from app.config import settings
-
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level.upper()),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+from fastapi.responses import ORJSONResponse
+from app.config import settings, configure_logging
+
+# Configure logging before the routers import the services, so their init logs are kept
+configure_logging()
+
+from app.routers import pdf, dify  # noqa: E402
+from app.services.dify_service import dify_service  # noqa: E402
+from app.services.storage import StorageUnavailableError  # noqa: E402
+
 logger = logging.getLogger(__name__)
-logger.debug("Logger initialized with level: %s", settings.log_level)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan: release shared clients on shutdown"""
+    logger.debug("Logger initialized with level: %s", settings.log_level)
+    yield
+    await dify_service.close()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="PDF Processing Backend",
     description="FastAPI backend for PDF upload, storage, and first-page extraction",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
+# Credentials are only allowed with an explicit origin list (the spec forbids them with "*")
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Adjust for production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=settings.cors_origins,
+    allow_credentials="*" not in settings.cors_origins,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
+# Seconds clients should wait before retrying when object storage is failing
+STORAGE_RETRY_AFTER_SECONDS = 5
+
+
+@app.exception_handler(StorageUnavailableError)
+async def storage_unavailable_handler(request: Request, exc: StorageUnavailableError):
+    """Map object storage failures (already retried by boto3) to 502 with Retry-After"""
+    return ORJSONResponse(
+        status_code=502,
+        content={"detail": f"Object storage unavailable: {exc}"},
+        headers={"Retry-After": str(STORAGE_RETRY_AFTER_SECONDS)}
+    )
+
+
 # Include routers
 app.include_router(pdf.router)
 app.include_router(dify.router)